@@ -1,46 +1,39 @@
+import asyncio
+
 import pytest
-from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy import insert, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+from httpx import ASGITransport, AsyncClient
 
 from main import app
-from app.models import Base, User
-from app.schemas import ThreadCreate, MessageCreate
-
-# Create test database
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
-)
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+from app.batcher import get_message_batcher
+from app.batch import MAX_BATCH_ITEMS, dispatch_batch
+from app.crud import clear_caches
+from app.db import _outdated_columns
+from app.schemas import BatchRequestItem
+from app.models import Message, Thread, User
+from app.websocket import MAX_FRAME_CHARS, ConnectionManager
 
-# Create test client
-client = TestClient(app)
 
 @pytest.fixture(scope="function")
-def db_session():
-    Base.metadata.create_all(bind=engine)
-    session = TestingSessionLocal()
-    try:
-        yield session
-    finally:
-        session.close()
-        Base.metadata.drop_all(bind=engine)
+async def test_user(db_session):
+    # Create a default test user; INSERT ... RETURNING hands back the row without a refresh
+    user = await db_session.scalar(insert(User).values(name="test_user").returning(User))
+    await db_session.commit()
+    return user
 
 @pytest.fixture(scope="function")
-def test_user(db_session):
-    # Create a default test user
-    user = User(name="test_user")
-    db_session.add(user)
-    db_session.commit()
-    db_session.refresh(user)
-    return user
+async def test_thread(db_session, test_user):
+    # Create a thread directly so tests that only read it skip the HTTP round-trip
+    thread = await db_session.scalar(
+        insert(Thread).values(title="Test Thread", user_id=test_user.id).returning(Thread)
+    )
+    await db_session.commit()
+    return thread
 
-def test_get_user(test_user):
-    response = client.get(f"/api/v1/users/{test_user.id}")
+async def test_get_user(client, test_user):
+    response = await client.get(f"/api/v1/users/{test_user.id}")
     assert response.status_code == 200
     data = response.json()
     
@@ -48,8 +41,8 @@ def test_get_user(test_user):
     assert data["name"] == "test_user"
     assert data["id"] == test_user.id
 
-def test_create_thread(test_user):
-    response = client.post(
+async def test_create_thread(client, test_user):
+    response = await client.post(
         "/api/v1/threads/",
         json={"title": "Test Thread", "user_id": test_user.id}
     )
@@ -60,32 +53,22 @@ def test_create_thread(test_user):
     assert data["user_id"] == test_user.id
     assert "id" in data
 
-def test_get_thread(test_user):
-    # First create a thread
-    thread_response = client.post(
-        "/api/v1/threads/",
-        json={"title": "Test Thread", "user_id": test_user.id}
-    )
-    thread_id = thread_response.json()["id"]
-    
-    # Then get the thread
-    response = client.get(f"/api/v1/threads/{thread_id}")
+async def test_get_thread(client, test_user, test_thread):
+    thread_id = test_thread.id
+
+    # Get the thread
+    response = await client.get(f"/api/v1/threads/{thread_id}")
     assert response.status_code == 200
     data = response.json()
     assert data["title"] == "Test Thread"
     assert data["user_id"] == test_user.id
     assert data["id"] == thread_id
 
-def test_create_message(test_user):
-    # First create a thread
-    thread_response = client.post(
-        "/api/v1/threads/",
-        json={"title": "Test Thread", "user_id": test_user.id}
-    )
-    thread_id = thread_response.json()["id"]
-    
-    # Then create a message
-    response = client.post(
+async def test_create_message(client, test_user, test_thread):
+    thread_id = test_thread.id
+
+    # Create a message
+    response = await client.post(
         f"/api/v1/threads/{thread_id}/messages/",
         json={"content": "Hello, world!", "role": "user"}
     )
@@ -96,22 +79,49 @@ def test_create_message(test_user):
     assert data["thread_id"] == thread_id
     assert "id" in data
 
-def test_get_thread_messages(test_user):
-    # First create a thread
-    thread_response = client.post(
-        "/api/v1/threads/",
-        json={"title": "Test Thread", "user_id": test_user.id}
-    )
-    thread_id = thread_response.json()["id"]
-    
-    # Create a message
-    client.post(
-        f"/api/v1/threads/{thread_id}/messages/",
+async def test_message_batcher_isolates_failing_row(db_session, test_thread):
+    batcher = app.dependency_overrides[get_message_batcher]()
+    loop = asyncio.get_running_loop()
+    good, bad = loop.create_future(), loop.create_future()
+
+    await batcher._flush([
+        ({"content": "kept", "role": "assistant", "thread_id": test_thread.id}, good),
+        ({"content": "orphan", "role": "assistant", "thread_id": 999}, bad),
+    ])
+
+    assert isinstance(good.result(), int)
+    assert isinstance(bad.exception(), IntegrityError)
+    result = await db_session.execute(select(Message.content).where(Message.thread_id == test_thread.id))
+    assert result.scalars().all() == ["kept"]
+
+async def test_create_message_rolls_back_user_message_when_reply_fails(client, db_session, test_thread):
+    class FailingBatcher:
+        async def process(self, row):
+            raise RuntimeError("insert failed")
+
+    app.dependency_overrides[get_message_batcher] = FailingBatcher
+    response = await client.post(
+        f"/api/v1/threads/{test_thread.id}/messages/",
         json={"content": "Hello, world!", "role": "user"}
     )
+    assert response.status_code == 503
+
+    # Nothing from the failed turn is left behind, so a retry can't duplicate it
+    result = await db_session.execute(select(Message.id).where(Message.thread_id == test_thread.id))
+    assert result.all() == []
+
+async def test_get_thread_messages(client, test_user, db_session, test_thread):
+    thread_id = test_thread.id
+
+    # Insert a message directly; the create endpoint has its own tests
+    await db_session.execute(
+        insert(Message),
+        [{"content": "Hello, world!", "role": "user", "thread_id": thread_id}]
+    )
+    await db_session.commit()
     
     # Get messages
-    response = client.get(f"/api/v1/threads/{thread_id}/messages/")
+    response = await client.get(f"/api/v1/threads/{thread_id}/messages/")
     assert response.status_code == 200
     data = response.json()
     assert len(data) == 1
@@ -119,57 +129,53 @@ def test_get_thread_messages(test_user):
     assert data[0]["role"] == "user"
     assert data[0]["thread_id"] == thread_id
 
-def test_get_user_threads(test_user):
-    # Create multiple threads
-    client.post(
-        "/api/v1/threads/",
-        json={"title": "Thread 1", "user_id": test_user.id}
-    )
-    client.post(
-        "/api/v1/threads/",
-        json={"title": "Thread 2", "user_id": test_user.id}
+async def test_get_user_threads(client, test_user, db_session):
+    # Create multiple threads in one executemany INSERT
+    await db_session.execute(
+        insert(Thread),
+        [
+            {"title": "Thread 1", "user_id": test_user.id},
+            {"title": "Thread 2", "user_id": test_user.id},
+        ]
     )
+    await db_session.commit()
     
     # Get user's threads
-    response = client.get(f"/api/v1/users/{test_user.id}/threads/")
+    response = await client.get(f"/api/v1/users/{test_user.id}/threads/")
     assert response.status_code == 200
     data = response.json()
     assert len(data) == 2
     assert all(thread["user_id"] == test_user.id for thread in data)
+    assert set(data[0]) == {"id", "title", "user_id"}
 
-def test_root_endpoint():
-    response = client.get("/")
+async def test_root_endpoint(client):
+    response = await client.get("/")
     assert response.status_code == 200
     assert response.json() == {"message": "Welcome to the Chatbot API"}
 
-def test_get_nonexistent_user():
-    response = client.get("/api/v1/users/999")
+async def test_get_nonexistent_user(client, db_session):
+    response = await client.get("/api/v1/users/999")
     assert response.status_code == 404
     assert response.json()["detail"] == "User not found"
 
-def test_get_nonexistent_thread():
-    response = client.get("/api/v1/threads/999")
+async def test_get_nonexistent_thread(client, db_session):
+    response = await client.get("/api/v1/threads/999")
     assert response.status_code == 404
     assert response.json()["detail"] == "Thread not found"
 
-def test_create_message_in_nonexistent_thread():
-    response = client.post(
+async def test_create_message_in_nonexistent_thread(client, db_session):
+    response = await client.post(
         "/api/v1/threads/999/messages/",
         json={"content": "Hello, world!", "role": "user"}
     )
     assert response.status_code == 404
     assert response.json()["detail"] == "Thread not found"
 
-def test_create_message_with_chatbot_response(test_user):
-    # First create a thread
-    thread_response = client.post(
-        "/api/v1/threads/",
-        json={"title": "Test Thread", "user_id": test_user.id}
-    )
-    thread_id = thread_response.json()["id"]
-    
+async def test_create_message_with_chatbot_response(client, test_user, test_thread):
+    thread_id = test_thread.id
+
     # Create a message and verify both user message and bot response
-    response = client.post(
+    response = await client.post(
         f"/api/v1/threads/{thread_id}/messages/",
         json={"content": "Hello, world!", "role": "user"}
     )
@@ -180,21 +186,183 @@ def test_create_message_with_chatbot_response(test_user):
     assert data["thread_id"] == thread_id
     
     # Verify bot response was created
-    messages_response = client.get(f"/api/v1/threads/{thread_id}/messages/")
+    messages_response = await client.get(f"/api/v1/threads/{thread_id}/messages/")
     assert messages_response.status_code == 200
     messages = messages_response.json()
     assert len(messages) == 2  # User message + bot response
     assert any(msg["role"] == "assistant" for msg in messages)
 
-def test_get_all_users(test_user, db_session):
-    # Get all users directly from the database
-    users = db_session.query(User).all()
-    assert users == 1
-    # We should see both our test user and the seeded Alice user
-    assert len(users) >= 1
-    # Verify our test user exists
-    assert any(user.id == test_user.id and user.name == "test_user" for user in users)
-    # Log the users for debugging
-    print("\nUsers in database:")
-    for user in users:
-        print(f"User ID: {user.id}, Name: {user.name}") 
\ No newline at end of file
+async def test_get_thread_messages_paginated(client, test_user, db_session, test_thread):
+    thread_id = test_thread.id
+
+    # Two turns of a user message followed by a bot response
+    await db_session.execute(
+        insert(Message),
+        [
+            {"content": "first", "role": "user", "thread_id": thread_id},
+            {"content": "reply", "role": "assistant", "thread_id": thread_id},
+            {"content": "second", "role": "user", "thread_id": thread_id},
+            {"content": "reply", "role": "assistant", "thread_id": thread_id},
+        ]
+    )
+    await db_session.commit()
+
+    response = await client.get(f"/api/v1/threads/{thread_id}/messages/?limit=2")
+    assert response.status_code == 200
+    latest = response.json()
+    assert [msg["role"] for msg in latest] == ["user", "assistant"]
+    assert latest[0]["content"] == "second"
+
+    response = await client.get(
+        f"/api/v1/threads/{thread_id}/messages/?limit=2&before_id={latest[0]['id']}"
+    )
+    assert response.status_code == 200
+    older = response.json()
+    assert [msg["role"] for msg in older] == ["user", "assistant"]
+    assert older[0]["content"] == "first"
+
+async def test_batch_requests(client, test_user):
+    response = await client.post(
+        "/api/v1/batch",
+        json=[
+            {"method": "GET", "url": f"/api/v1/users/{test_user.id}"},
+            {"method": "GET", "url": "/api/v1/unknown/"},
+        ]
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["status_code"] for item in data] == [200, 404]
+    assert data[0]["body"]["name"] == "test_user"
+
+async def test_nested_batch_rejected_behind_root_path(db_session):
+    nested = {"method": "POST", "url": "/api/v1/batch", "body": [{"method": "GET", "url": "/"}]}
+    transport = ASGITransport(app=app, root_path="/x")
+    async with AsyncClient(transport=transport, base_url="http://test") as prefixed:
+        response = await prefixed.post("/api/v1/batch", json=[nested])
+    assert response.status_code == 400
+
+async def test_batch_subrequest_cannot_batch(db_session):
+    # Goes straight to the dispatcher, so only the sub-request marker can stop the inner batch
+    nested = BatchRequestItem(method="POST", url="/api/v1/batch", body=[{"method": "GET", "url": "/"}])
+    [result] = await dispatch_batch(app, {"type": "http"}, [nested])
+    assert result.status_code == 400
+
+async def test_batch_size_is_capped(client):
+    items = [{"method": "GET", "url": "/"}] * (MAX_BATCH_ITEMS + 1)
+    response = await client.post("/api/v1/batch", json=items)
+    assert response.status_code == 422
+
+async def test_batch_requests_with_non_json_body(client, test_user):
+    response = await client.post(
+        "/api/v1/batch",
+        json=[
+            {"method": "GET", "url": "/docs"},
+            {"method": "GET", "url": f"/api/v1/users/{test_user.id}"},
+        ]
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["status_code"] for item in data] == [200, 200]
+    assert "<html>" in data[0]["body"].lower()
+    assert data[1]["body"]["name"] == "test_user"
+
+async def test_cleared_user_cache_is_not_served(client, db_session, test_user):
+    response = await client.get(f"/api/v1/users/{test_user.id}")
+    assert response.json()["name"] == "test_user"
+
+    # Cached without invalidation, so the rename stays hidden until the cache is cleared
+    await db_session.execute(update(User).where(User.id == test_user.id).values(name="renamed_user"))
+    await db_session.commit()
+    response = await client.get(f"/api/v1/users/{test_user.id}")
+    assert response.json()["name"] == "test_user"
+
+    # What the db_session fixture does between tests
+    clear_caches()
+    response = await client.get(f"/api/v1/users/{test_user.id}")
+    assert response.json()["name"] == "renamed_user"
+
+async def test_websocket_turn_is_stored_and_broadcast_once(db_session, test_thread, websocket_connect):
+    thread_id = test_thread.id
+    async with websocket_connect(f"/ws/threads/{thread_id}") as websocket:
+        await websocket.send_text('{"content": "Hello, socket!"}')
+        frame = await websocket.receive_json()
+
+    # The user message and the bot reply arrive together as a single frame
+    assert frame["type"] == "messages"
+    items = frame["data"]["items"]
+    assert [item["role"] for item in items] == ["user", "assistant"]
+    assert items[0]["content"] == "Hello, socket!"
+    assert all(item["thread_id"] == thread_id for item in items)
+
+    result = await db_session.execute(
+        select(Message.id, Message.role).where(Message.thread_id == thread_id).order_by(Message.id)
+    )
+    assert [(row.id, row.role) for row in result] == [(item["id"], item["role"]) for item in items]
+
+async def test_websocket_drops_oversized_and_malformed_frames(db_session, test_thread, websocket_connect):
+    async with websocket_connect(f"/ws/threads/{test_thread.id}") as websocket:
+        await websocket.send_text('{"content": "%s"}' % ("x" * MAX_FRAME_CHARS))
+        await websocket.send_text("not json")
+        await websocket.send_text('{"text": "wrong shape"}')
+        await websocket.send_text('{"content": "still here"}')
+        # Only the valid frame produces a turn, and the socket stays open
+        frame = await websocket.receive_json()
+
+    assert frame["data"]["items"][0]["content"] == "still here"
+    result = await db_session.execute(
+        select(Message.content).where(Message.thread_id == test_thread.id)
+    )
+    assert len(result.all()) == 2
+
+async def test_broadcast_removes_failed_socket():
+    class FakeSocket:
+        def __init__(self, fail):
+            self.fail = fail
+            self.sent = []
+
+        async def accept(self):
+            pass
+
+        async def send_text(self, payload):
+            if self.fail:
+                raise RuntimeError("socket is gone")
+            self.sent.append(payload)
+
+    manager = ConnectionManager()
+    healthy, broken = FakeSocket(fail=False), FakeSocket(fail=True)
+    await manager.connect(healthy, 1)
+    await manager.connect(broken, 1)
+
+    await manager.broadcast_to_thread({"type": "messages", "data": {"items": []}}, 1)
+
+    assert healthy.sent == ['{"type":"messages","data":{"items":[]}}']
+    assert manager.active_connections[1] == {healthy}
+
+async def test_outdated_schema_is_detected(engine):
+    async with engine.connect() as conn:
+        assert await conn.run_sync(_outdated_columns) == []
+
+    # Tables as the original create_all left them: string roles, timestamps filled in by Python
+    old_engine = create_async_engine("sqlite+aiosqlite://")
+    try:
+        async with old_engine.begin() as conn:
+            await conn.execute(text(
+                "CREATE TABLE thread (id INTEGER PRIMARY KEY, title VARCHAR(100), "
+                "created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL, user_id INTEGER)"
+            ))
+            await conn.execute(text(
+                "CREATE TABLE message (id INTEGER PRIMARY KEY, content TEXT, role VARCHAR(20) NOT NULL, "
+                "created_at DATETIME NOT NULL, thread_id INTEGER)"
+            ))
+            outdated = await conn.run_sync(_outdated_columns)
+    finally:
+        await old_engine.dispose()
+    assert outdated == ["message.role", "thread.created_at", "thread.updated_at", "message.created_at"]
+
+async def test_get_all_users(client, test_user, db_session):
+    # Get all users directly from the database; lifespan seeding doesn't run under the test client
+    result = await db_session.execute(select(User))
+    users = list(result.scalars().all())
+    assert len(users) == 1
+    assert users[0].id == test_user.id
+    assert users[0].name == "test_user"
@@ -1,121 +1,144 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 
-from app.db import get_db
+from app.db import get_async_db
 from app.models import User, Thread, Message
-from app.schemas import User, ThreadCreate, Thread, MessageCreate, Message
+from app.schemas import (
+    User, UserSummary, ThreadCreate, Thread, ThreadListItem, MessageCreate, Message,
+    BatchRequestItem, BatchResponseItem
+)
 from app.crud import (
-    get_user, get_user_threads,
+    get_user_summary, get_user_threads,
     get_thread, create_thread, get_thread_messages,
-    create_message, get_user_by_name
+    create_message, delete_message, get_user_by_name
 )
-from app.chatbot import SimpleChatbot
+from app.batch import MAX_BATCH_ITEMS, dispatch_batch, is_batch_subrequest
+from app.batcher import MessageBatcher, get_message_batcher
+from app.chatbot import SimpleChatbot, get_chatbot
+from app.history import history_cache
+from app.responses import MsgSpecResponse, message_out, thread_list_item_out
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-chatbot = SimpleChatbot()
 
 @router.post("/users/", response_model=User)
-def create_user(user: User, db: Session = Depends(get_db)):
-    try:
-        db_user = get_user_by_name(db, name=user.name)
-        if db_user:
-            raise HTTPException(status_code=400, detail="User already exists")
-        db_user = User(**user.model_dump())
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
-        return db_user
-    except Exception as e:
-        logger.error(f"Failed to create user: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to create user")
-
-@router.get("/users/{user_id}", response_model=User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    try:
-        db_user = get_user(db, user_id)
-        if db_user is None:
-            raise HTTPException(status_code=404, detail="User not found")
-        return db_user
-    except Exception as e:
-        logger.error(f"Failed to get user {user_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to get user")
+async def create_user(user: User, db: AsyncSession = Depends(get_async_db)):
+    db_user = await get_user_by_name(db, name=user.name)
+    if db_user:
+        raise HTTPException(status_code=400, detail="User already exists")
+    db_user = User(**user.model_dump())
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+@router.get("/users/{user_id}", response_model=UserSummary)
+async def read_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user_summary(db, user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 
 @router.post("/threads/", response_model=Thread)
-def create_new_thread(thread: ThreadCreate, db: Session = Depends(get_db)):
-    try:
-        db_thread = create_thread(db, thread)
-        logger.info(f"Created new thread: {db_thread.title}")
-        return db_thread
-    except Exception as e:
-        logger.error(f"Failed to create thread: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to create thread")
+async def create_new_thread(thread: ThreadCreate, db: AsyncSession = Depends(get_async_db)):
+    db_thread = await create_thread(db, thread)
+    logger.info("Created new thread: %s", db_thread.title)
+    return db_thread
 
 
 @router.get("/threads/{thread_id}", response_model=Thread)
-def read_thread(thread_id: int, db: Session = Depends(get_db)):
-    try:
-        db_thread = get_thread(db, thread_id)
-        if db_thread is None:
-            raise HTTPException(status_code=404, detail="Thread not found")
-        return db_thread
-    except Exception as e:
-        logger.error(f"Failed to get thread {thread_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to get thread")
+async def read_thread(thread_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_thread = await get_thread(db, thread_id)
+    if db_thread is None:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    return db_thread
 
 
-@router.get("/users/{user_id}/threads/", response_model=List[Thread])
-def read_user_threads(user_id: int, db: Session = Depends(get_db)):
-    try:
-        threads = get_user_threads(db, user_id)
-        return threads
-    except Exception as e:
-        logger.error(f"Failed to get threads for user {user_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to get user threads")
+@router.get("/users/{user_id}/threads/", responses={200: {"model": List[ThreadListItem]}})
+async def read_user_threads(
+    user_id: int,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_async_db),
+):
+    threads = await get_user_threads(db, user_id, limit=limit, offset=offset)
+    return MsgSpecResponse([thread_list_item_out(thread) for thread in threads])
 
 
-@router.post("/threads/{thread_id}/messages/", response_model=Message)
-def create_new_message(thread_id: int, message: MessageCreate, db: Session = Depends(get_db)):
+@router.post("/threads/{thread_id}/messages/", responses={200: {"model": Message}})
+async def create_new_message(
+    thread_id: int,
+    message: MessageCreate,
+    db: AsyncSession = Depends(get_async_db),
+    batcher: MessageBatcher = Depends(get_message_batcher),
+    chatbot: SimpleChatbot = Depends(get_chatbot),
+):
+    # The thread FK stands in for an existence check
     try:
-        # Verify thread exists
-        db_thread = get_thread(db, thread_id)
-        if db_thread is None:
-            raise HTTPException(status_code=404, detail="Thread not found")
-        
-        # Create user message
-        db_message = create_message(db, message, thread_id)
-        logger.info(f"Created new user message in thread {thread_id}")
-        
-        # Get conversation history
-        conversation_history = get_thread_messages(db, thread_id)
-        history_dict = [{"role": msg.role, "content": msg.content} for msg in conversation_history]
-        
-        # Generate and create bot response
-        bot_response = chatbot.generate_response(message.content, history_dict)
-        bot_message = MessageCreate(
-            content=bot_response,
-            role="assistant"
-        )
-        db_bot_message = create_message(db, bot_message, thread_id)
-        logger.info(f"Created bot response in thread {thread_id}")
-        
-        return db_message
-    except Exception as e:
-        logger.error(f"Failed to create message: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to create message")
-
-
-@router.get("/threads/{thread_id}/messages/", response_model=List[Message])
-def read_thread_messages(thread_id: int, db: Session = Depends(get_db)):
+        async with db.begin():
+            # Get conversation history before the new row is flushed
+            history = await history_cache.get(db, thread_id)
+
+            # Create user message
+            db_message = await create_message(db, message, thread_id, commit=False)
+            history_cache.append(thread_id, message.role, message.content)
+            logger.info("Created new user message in thread %s", thread_id)
+    except IntegrityError:
+        history_cache.invalidate(thread_id)
+        raise HTTPException(status_code=404, detail="Thread not found")
+    except Exception:
+        # The cached history may hold a row that was rolled back
+        history_cache.invalidate(thread_id)
+        raise
+
+    # Generate bot response and queue it for a batched insert
+    bot_response = chatbot.generate_response(message.content, history)
+    # Server-generated, so skip validation
+    bot_message = MessageCreate.model_construct(
+        content=bot_response,
+        role="assistant"
+    )
     try:
-        messages = get_thread_messages(db, thread_id)
-        return messages
-    except Exception as e:
-        logger.error(f"Failed to get messages for thread {thread_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to get thread messages") 
\ No newline at end of file
+        bot_message_id = await batcher.process({**bot_message.model_dump(), "thread_id": thread_id})
+    except Exception:
+        # Drop the already committed user message so a retry doesn't store it twice
+        logger.exception("Failed to store bot response in thread %s", thread_id)
+        history_cache.invalidate(thread_id)
+        await delete_message(db, db_message.id)
+        raise HTTPException(status_code=503, detail="Chatbot response could not be stored")
+    history_cache.append(thread_id, bot_message.role, bot_message.content)
+    logger.info("Created bot response %s in thread %s", bot_message_id, thread_id)
+
+    # The row came back from our own INSERT, so encode it directly instead of revalidating it
+    return MsgSpecResponse(message_out(db_message))
+
+
+@router.get("/threads/{thread_id}/messages/", responses={200: {"model": List[Message]}})
+async def read_thread_messages(
+    thread_id: int,
+    limit: Optional[int] = Query(None, ge=1),
+    before_id: Optional[int] = Query(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    messages = await get_thread_messages(db, thread_id, limit=limit, before_id=before_id)
+    return MsgSpecResponse([message_out(message) for message in messages])
+
+
+@router.post("/batch", response_model=List[BatchResponseItem])
+async def batch_requests(
+    request: Request,
+    items: List[BatchRequestItem] = Body(..., max_length=MAX_BATCH_ITEMS),
+):
+    """Run several independent API calls in one round-trip."""
+    # Sub-request paths never carry root_path, so compare against the scope's own path
+    path = request.scope["path"].rstrip("/")
+    if is_batch_subrequest(request.scope) or any(
+        item.url.split("?")[0].rstrip("/") == path for item in items
+    ):
+        raise HTTPException(status_code=400, detail="Batch requests cannot be nested")
+    return await dispatch_batch(request.app, request.scope, items)
@@ -0,0 +1,97 @@
+from typing import Any, List
+import asyncio
+import logging
+import orjson
+
+from starlette.types import ASGIApp, Scope
+
+from app.schemas import BatchRequestItem, BatchResponseItem
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on items in one batch request
+MAX_BATCH_ITEMS = 20
+# Sub-requests of one batch in flight at once; kept well below the engine's pool of 20 + 10
+MAX_CONCURRENT_DISPATCHES = 8
+
+
+def is_batch_subrequest(scope: Scope) -> bool:
+    """True for scopes built by _dispatch, so a batch can't be issued from inside another one."""
+    return scope.get("extensions", {}).get("batch", False)
+
+
+async def _dispatch(app: ASGIApp, scope: Scope, item: BatchRequestItem) -> BatchResponseItem:
+    """Run a single sub-request through the ASGI app and collect its response."""
+    body = b"" if item.body is None else orjson.dumps(item.body)
+    path, _, query = item.url.partition("?")
+    sub_scope = {
+        "type": "http",
+        "asgi": scope.get("asgi", {"version": "3.0"}),
+        "http_version": scope.get("http_version", "1.1"),
+        "scheme": scope.get("scheme", "http"),
+        "server": scope.get("server"),
+        "client": scope.get("client"),
+        "root_path": scope.get("root_path", ""),
+        "method": item.method.upper(),
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "extensions": {"batch": True},
+    }
+
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if request_sent:
+            return {"type": "http.disconnect"}
+        request_sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    status_code = 500
+    content_type = b""
+    chunks = []
+
+    async def send(message):
+        nonlocal status_code, content_type
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+            content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await app(sub_scope, receive, send)
+    except Exception as e:
+        logger.error("Batched request %s %s failed: %s", item.method, item.url, e)
+        return BatchResponseItem(status_code=500, body={"detail": "Internal Server Error"})
+
+    content = b"".join(chunks)
+    return BatchResponseItem(status_code=status_code, body=_decode_body(content, content_type))
+
+
+def _decode_body(content: bytes, content_type: bytes) -> Any:
+    """JSON bodies are returned parsed; anything else (e.g. the HTML docs page) as text."""
+    if not content:
+        return None
+    if content_type.split(b";")[0].strip() == b"application/json":
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+    return content.decode("utf-8", errors="replace")
+
+
+async def dispatch_batch(app: ASGIApp, scope: Scope, items: List[BatchRequestItem]) -> List[BatchResponseItem]:
+    """Run independent sub-requests concurrently; results keep the order of the input."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DISPATCHES)
+
+    async def dispatch(item: BatchRequestItem) -> BatchResponseItem:
+        async with semaphore:
+            return await _dispatch(app, scope, item)
+
+    return list(await asyncio.gather(*(dispatch(item) for item in items)))
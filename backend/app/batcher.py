@@ -0,0 +1,89 @@
+from typing import Callable, List, Optional, Set, Tuple
+import asyncio
+import logging
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import AsyncSessionLocal
+from app.models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBatcher:
+    """
+    Coalesce message inserts from concurrent requests into one multi-row INSERT.
+    A row arriving while nothing is being written goes out at once; rows that arrive during a write
+    are batched until max_batch_size or max_queue_time seconds after the first of them.
+    If a batch fails, its rows are retried one at a time so only the bad row reports an error.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        max_batch_size: int = 64,
+        max_queue_time: float = 0.01,
+    ):
+        self.session_factory = session_factory
+        self.max_batch_size = max_batch_size
+        self.max_queue_time = max_queue_time
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def process(self, row: dict) -> int:
+        """Queue a message row for insertion and return its id once the batch is committed."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+        if len(self._pending) >= self.max_batch_size or not self._flushes:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_queue_time, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._flush(batch))
+            # Hold a reference so the task isn't garbage collected mid-flight
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _insert(self, rows: List[dict]) -> List[int]:
+        stmt = insert(Message).returning(Message.id, sort_by_parameter_order=True)
+        async with self.session_factory() as db:
+            result = await db.execute(stmt, rows)
+            ids = list(result.scalars().all())
+            await db.commit()
+        return ids
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            ids = await self._insert([row for row, _ in batch])
+        except Exception as e:
+            logger.error("Error inserting batch of %d messages: %s", len(batch), e)
+            if len(batch) == 1:
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # Isolate the failing row(s) so the rest of the batch still gets stored
+            for item in batch:
+                await self._flush([item])
+            return
+        for (_, future), message_id in zip(batch, ids):
+            if not future.done():
+                future.set_result(message_id)
+
+
+message_batcher = MessageBatcher(AsyncSessionLocal)
+
+
+def get_message_batcher() -> MessageBatcher:
+    """Dependency function to get the shared message batcher."""
+    return message_batcher
@@ -1,9 +1,10 @@
-from typing import List
+from functools import lru_cache
+from typing import Sequence
 import random
 
 class SimpleChatbot:
     def __init__(self):
-        self.responses = [
+        self.responses = (
             "I understand your concern. Let me help you with that.",
             "That's an interesting question. Here's what I think...",
             "I can help you with that. Let me explain...",
@@ -14,9 +15,11 @@ class SimpleChatbot:
             "Let me help you with that information...",
             "I can provide guidance on that topic...",
             "Here's what you need to know about that..."
-        ]
+        )
+        # Private generator so picks don't go through the module-level random instance
+        self._rng = random.Random()
     
-    def generate_response(self, user_message: str, conversation_history: List[dict]) -> str:
+    def generate_response(self, user_message: str, conversation_history: Sequence[dict]) -> str:
         """
         Generate a simple response based on the user's message and conversation history.
         In a real implementation, this would be replaced with actual AI/ML logic.
@@ -24,4 +27,10 @@ class SimpleChatbot:
         # For now, we'll just return a random response
         # In a real implementation, you would use the conversation history and user message
         # to generate a more contextual response
-        return random.choice(self.responses) 
\ No newline at end of file
+        return self.responses[self._rng.randrange(len(self.responses))]
+
+
+@lru_cache(maxsize=1)
+def get_chatbot() -> SimpleChatbot:
+    """Dependency function to get the shared chatbot instance."""
+    return SimpleChatbot()
@@ -1,77 +1,217 @@
-from typing import List, Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from typing import List, Optional, Tuple
+from cachetools import TTLCache
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy import bindparam, delete, insert, select
 import logging
 
 from app.models import User, Thread, Message
-from app.schemas import ThreadCreate, MessageCreate
+from app.schemas import ThreadCreate, MessageCreate, UserSummary
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hot-path statements are built once; callers only supply the bound values
+_select_user_by_id = select(User).where(User.id == bindparam("user_id"))
+_select_user_by_name = select(User).where(User.name == bindparam("name"))
+_select_thread = (
+    select(Thread)
+    .where(Thread.id == bindparam("thread_id"))
+    .options(selectinload(Thread.messages))
+)
+_select_thread_id = select(Thread.id).where(Thread.id == bindparam("thread_id"))
+_select_thread_history = (
+    select(Message.role, Message.content)
+    .where(Message.thread_id == bindparam("thread_id"))
+    .order_by(Message.id.desc())
+    .limit(bindparam("limit"))
+)
+
+
+async def get_user(db: AsyncSession, user_id: int) -> Optional[User]:
+    try:
+        result = await db.execute(_select_user_by_id, {"user_id": user_id})
+        return result.scalars().first()
+    except Exception as e:
+        logger.error("Error getting user %s: %s", user_id, e)
+        raise
+
+
+# Detached snapshots of recently read users; ORM instances are never shared across sessions
+_user_summaries: TTLCache = TTLCache(maxsize=1024, ttl=30)
+
+
+async def get_user_summary(db: AsyncSession, user_id: int) -> Optional[UserSummary]:
+    """get_user for read-only callers, served from a short-lived cache on repeat lookups."""
+    summary = _user_summaries.get(user_id)
+    if summary is None:
+        user = await get_user(db, user_id)
+        if user is None:
+            return None
+        summary = _user_summaries[user_id] = UserSummary.model_validate(user)
+    return summary
 
-def get_user(db: Session, user_id: int) -> Optional[User]:
+
+async def get_user_by_name(db: AsyncSession, name: str) -> Optional[User]:
     try:
-        return db.query(User).filter(User.id == user_id).first()
+        result = await db.execute(_select_user_by_name, {"name": name})
+        return result.scalars().first()
     except Exception as e:
-        logger.error(f"Error getting user {user_id}: {str(e)}")
+        logger.error("Error getting user by name %s: %s", name, e)
         raise
 
 
-def get_user_by_name(db: Session, name: str) -> Optional[User]:
+async def get_thread(db: AsyncSession, thread_id: int) -> Optional[Thread]:
     try:
-        return db.query(User).filter(User.name == name).first()
+        result = await db.execute(_select_thread, {"thread_id": thread_id})
+        return result.scalars().first()
     except Exception as e:
-        logger.error(f"Error getting user by name {name}: {str(e)}")
+        logger.error("Error getting thread %s: %s", thread_id, e)
         raise
 
 
-def get_thread(db: Session, thread_id: int) -> Optional[Thread]:
+# Threads are never deleted while the app runs, so a positive hit stays valid until it ages out
+_existing_threads: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+
+
+async def thread_exists(db: AsyncSession, thread_id: int) -> bool:
+    """Cheap existence probe for a thread, cached for repeat connects."""
+    if thread_id in _existing_threads:
+        return True
     try:
-        return db.query(Thread).filter(Thread.id == thread_id).first()
+        result = await db.execute(_select_thread_id, {"thread_id": thread_id})
+        exists = result.first() is not None
     except Exception as e:
-        logger.error(f"Error getting thread {thread_id}: {str(e)}")
+        logger.error("Error checking thread %s: %s", thread_id, e)
         raise
+    if exists:
+        _existing_threads[thread_id] = True
+    return exists
+
 
+def clear_caches():
+    """Drop every cached user and thread lookup, e.g. after the database was rolled back."""
+    _user_summaries.clear()
+    _existing_threads.clear()
 
-def get_user_threads(db: Session, user_id: int) -> List[Thread]:
+
+async def get_user_threads(
+    db: AsyncSession, user_id: int, limit: Optional[int] = None, offset: int = 0
+) -> List[Row]:
+    """Fetch (id, title, user_id) rows for a user's threads; messages and timestamps are not loaded."""
     try:
-        return db.query(Thread).filter(Thread.user_id == user_id).all()
+        stmt = (
+            select(Thread.id, Thread.title, Thread.user_id)
+            .where(Thread.user_id == user_id)
+            .order_by(Thread.id)
+            .offset(offset)
+            .limit(limit)
+        )
+        result = await db.execute(stmt)
+        return list(result.all())
     except Exception as e:
-        logger.error(f"Error getting threads for user {user_id}: {str(e)}")
+        logger.error("Error getting threads for user %s: %s", user_id, e)
         raise
 
 
-def create_thread(db: Session, thread: ThreadCreate) -> Thread:
+async def create_thread(db: AsyncSession, thread: ThreadCreate) -> Thread:
     try:
-        db_thread = Thread(**thread.model_dump())
+        # A new thread has no messages; setting the collection up front avoids a lazy load
+        db_thread = Thread(**thread.model_dump(), messages=[])
         db.add(db_thread)
-        db.commit()
-        db.refresh(db_thread)
+        await db.commit()
         return db_thread
     except Exception as e:
-        logger.error(f"Error creating thread: {str(e)}")
-        db.rollback()
+        logger.error("Error creating thread: %s", e)
+        await db.rollback()
+        raise
+
+
+async def get_thread_messages(
+    db: AsyncSession, thread_id: int, limit: Optional[int] = None, before_id: Optional[int] = None
+) -> List[Message]:
+    """
+    Fetch a thread's messages in order.
+    With limit, only the newest `limit` messages (older than before_id, if given) are returned.
+    """
+    try:
+        stmt = select(Message).where(Message.thread_id == thread_id)
+        if before_id is not None:
+            stmt = stmt.where(Message.id < before_id)
+        if limit is None:
+            result = await db.execute(stmt.order_by(Message.id))
+            return list(result.scalars().all())
+        result = await db.execute(stmt.order_by(Message.id.desc()).limit(limit))
+        return list(reversed(result.scalars().all()))
+    except Exception as e:
+        logger.error("Error getting messages for thread %s: %s", thread_id, e)
+        raise
+
+
+async def get_thread_history(
+    db: AsyncSession, thread_id: int, limit: int = 32
+) -> List[Tuple[str, str]]:
+    """Fetch the newest `limit` (role, content) pairs of a thread, oldest first, without hydrating Message objects."""
+    try:
+        result = await db.execute(_select_thread_history, {"thread_id": thread_id, "limit": limit})
+        return [tuple(row) for row in reversed(result.all())]
+    except Exception as e:
+        logger.error("Error getting history for thread %s: %s", thread_id, e)
         raise
 
 
-def get_thread_messages(db: Session, thread_id: int) -> List[Message]:
+async def create_message(
+    db: AsyncSession, message: MessageCreate, thread_id: int, commit: bool = True
+) -> Message:
+    """
+    Insert a message with a single INSERT ... RETURNING round-trip.
+    With commit=False the row is left in the caller's transaction.
+    """
     try:
-        return db.query(Message).filter(Message.thread_id == thread_id).all()
+        values = message.model_dump()
+        stmt = (
+            insert(Message)
+            .values(**values, thread_id=thread_id)
+            .returning(Message.id, Message.created_at)
+        )
+        row = (await db.execute(stmt)).one()
+        if commit:
+            await db.commit()
+        return Message(id=row.id, created_at=row.created_at, thread_id=thread_id, **values)
     except Exception as e:
-        logger.error(f"Error getting messages for thread {thread_id}: {str(e)}")
+        logger.error("Error creating message: %s", e)
+        if commit:
+            await db.rollback()
         raise
 
 
-def create_message(db: Session, message: MessageCreate, thread_id: int) -> Message:
+async def delete_message(db: AsyncSession, message_id: int):
+    """Delete a single message and commit."""
     try:
-        db_message = Message(**message.model_dump(), thread_id=thread_id)
-        db.add(db_message)
-        db.commit()
-        db.refresh(db_message)
-        return db_message
+        await db.execute(delete(Message).where(Message.id == message_id))
+        await db.commit()
     except Exception as e:
-        logger.error(f"Error creating message: {str(e)}")
-        db.rollback()
-        raise 
\ No newline at end of file
+        logger.error("Error deleting message %s: %s", message_id, e)
+        await db.rollback()
+        raise
+
+
+async def create_messages(
+    db: AsyncSession, messages: List[MessageCreate], thread_id: int
+) -> List[Message]:
+    """Insert several messages in one multi-row INSERT ... RETURNING and commit them together."""
+    try:
+        rows = [{**message.model_dump(), "thread_id": thread_id} for message in messages]
+        stmt = insert(Message).returning(
+            Message.id, Message.created_at, sort_by_parameter_order=True
+        )
+        result = (await db.execute(stmt, rows)).all()
+        await db.commit()
+        return [
+            Message(id=returned.id, created_at=returned.created_at, **row)
+            for row, returned in zip(rows, result)
+        ]
+    except Exception as e:
+        logger.error("Error creating %d messages: %s", len(messages), e)
+        await db.rollback()
+        raise
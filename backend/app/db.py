@@ -1,25 +1,82 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy.orm import sessionmaker
+from functools import lru_cache
+from typing import Callable, List
+from sqlalchemy import Integer, inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 
 from app.models import Base
 
 _main_uri = "postgres:postgres@localhost:5432/postgres"
-_sync_uri = f"postgresql://{_main_uri}"
-_async_uri = f"postgresql+asyncpg://{_main_uri}"
+_async_uri = f"postgresql+asyncpg://{_main_uri}?prepared_statement_cache_size=512"
 
-sync_engine = create_engine(_sync_uri)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
 
-Base.metadata.create_all(sync_engine)
+# Built on first use so importing the app (e.g. in tests that override the session) doesn't set up the driver
+@lru_cache(maxsize=1)
+def get_engine() -> AsyncEngine:
+    # asyncpg keeps prepared statements per connection; LIFO checkout reuses the warmest connections.
+    # Each worker process holds up to pool_size + max_overflow connections, so keep
+    # (pool_size + max_overflow) * workers below the server's max_connections
+    return create_async_engine(
+        _async_uri,
+        echo=False,
+        pool_size=20,
+        max_overflow=10,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        pool_use_lifo=True,
+        # Headroom over the default 500 so every CRUD statement's compiled form stays cached
+        query_cache_size=1200,
+        connect_args={"statement_cache_size": 512},
+    )
 
-engine = create_async_engine(_async_uri)
 
+@lru_cache(maxsize=1)
+def get_sessionmaker() -> async_sessionmaker:
+    return async_sessionmaker(autoflush=False, expire_on_commit=False, bind=get_engine())
 
-def get_db():
-    """Dependency function to get a database session."""
-    db = SessionLocal()
-    try:
+
+def AsyncSessionLocal() -> AsyncSession:
+    """Open a new session on the shared async engine."""
+    return get_sessionmaker()()
+
+
+def _outdated_columns(connection: Connection) -> List[str]:
+    """Columns that an older create_all left in a shape the models can no longer read or write."""
+    inspector = inspect(connection)
+    columns = {
+        table: {column["name"]: column for column in inspector.get_columns(table)}
+        for table in ("thread", "message")
+    }
+    outdated = []
+    if not isinstance(columns["message"]["role"]["type"], Integer):
+        outdated.append("message.role")
+    for table, name in (("thread", "created_at"), ("thread", "updated_at"), ("message", "created_at")):
+        if columns[table][name]["default"] is None:
+            outdated.append(f"{table}.{name}")
+    return outdated
+
+
+async def init_db():
+    """
+    Create any missing tables. Called once at application startup.
+    create_all never alters existing tables, so an outdated schema stops startup instead of corrupting rows.
+    """
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        outdated = await conn.run_sync(_outdated_columns)
+    if outdated:
+        raise RuntimeError(
+            f"Database schema is out of date ({', '.join(outdated)}); "
+            "apply backend/migrations/001_role_codes_defaults_cascades.sql and restart"
+        )
+
+
+def get_session_factory() -> Callable[[], AsyncSession]:
+    """Dependency function for handlers that open their own sessions, such as the websocket loop."""
+    return AsyncSessionLocal
+
+
+async def get_async_db():
+    """Dependency function to get an async database session."""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,44 @@
+from collections import deque
+from typing import Deque
+from cachetools import TTLCache
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud import get_thread_history
+
+
+class ConversationHistoryCache:
+    """
+    In-process cache of per-thread conversation history.
+    A thread is loaded from the database once, then kept current by appending new messages.
+    Only the newest max_messages entries are kept, so per-turn work doesn't grow with thread age.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 600, max_messages: int = 32):
+        self._histories: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.max_messages = max_messages
+
+    async def get(self, db: AsyncSession, thread_id: int) -> Deque[dict]:
+        history = self._histories.get(thread_id)
+        if history is None:
+            rows = await get_thread_history(db, thread_id, limit=self.max_messages)
+            history = deque(
+                ({"role": role, "content": content} for role, content in rows),
+                maxlen=self.max_messages,
+            )
+            self._histories[thread_id] = history
+        return history
+
+    def append(self, thread_id: int, role: str, content: str):
+        # Threads that are not cached yet are loaded from the database on the next get()
+        history = self._histories.get(thread_id)
+        if history is not None:
+            history.append({"role": role, "content": content})
+
+    def invalidate(self, thread_id: int):
+        self._histories.pop(thread_id, None)
+
+    def clear(self):
+        self._histories.clear()
+
+
+history_cache = ConversationHistoryCache()
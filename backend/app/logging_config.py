@@ -0,0 +1,28 @@
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import logging
+import queue
+
+
+def setup_logging(level: int = logging.INFO) -> QueueListener:
+    """
+    Configure the root logger to hand records to a queue.
+    A background QueueListener does the actual console writes, keeping I/O off the event loop.
+    """
+    log_queue = queue.SimpleQueue()
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    listener = QueueListener(log_queue, console_handler, respect_handler_level=True)
+
+    # Replace any handlers already on the root logger (e.g. from a basicConfig call)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
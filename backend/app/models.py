@@ -1,5 +1,9 @@
 from datetime import datetime
-from sqlalchemy import String, ForeignKey, DateTime, Text
+import enum
+from sqlalchemy import SmallInteger, String, ForeignKey, DateTime, Index, Text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from typing import List
 
@@ -8,12 +12,57 @@ class Base(DeclarativeBase):
     pass
 
 
+class utcnow(FunctionElement):
+    """Current time in UTC for naive DateTime columns, whatever the database session's time zone."""
+
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, "postgresql")
+def _utcnow_postgresql(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already UTC
+    return "CURRENT_TIMESTAMP"
+
+
+class Role(str, enum.Enum):
+    user = "user"
+    assistant = "assistant"
+
+
+class RoleType(TypeDecorator):
+    """Stores a Role as a SMALLINT code; Python code keeps seeing Role members."""
+
+    impl = SmallInteger
+    cache_ok = True
+
+    _codes = {Role.user: 1, Role.assistant: 2}
+    _roles = {code: role for role, code in _codes.items()}
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return self._codes[Role(value)]
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self._roles[value]
+
+
 class User(Base):
     __tablename__ = "user"
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(30))
-    threads: Mapped[List["Thread"]] = relationship(back_populates="user", cascade="all, delete-orphan")
+    threads: Mapped[List["Thread"]] = relationship(
+        back_populates="user", cascade="all, delete-orphan", passive_deletes=True, lazy="raise_on_sql"
+    )
 
     def __repr__(self) -> str:
         return f"User(id={self.id!r}, name={self.name!r})"
@@ -24,12 +73,14 @@ class Thread(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str] = mapped_column(String(100))
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=utcnow())
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=utcnow(), onupdate=utcnow())
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id", ondelete="CASCADE"), index=True)
     
-    user: Mapped["User"] = relationship(back_populates="threads")
-    messages: Mapped[List["Message"]] = relationship(back_populates="thread", cascade="all, delete-orphan")
+    user: Mapped["User"] = relationship(back_populates="threads", lazy="raise_on_sql")
+    messages: Mapped[List["Message"]] = relationship(
+        back_populates="thread", cascade="all, delete-orphan", passive_deletes=True, lazy="raise_on_sql"
+    )
 
     def __repr__(self) -> str:
         return f"Thread(id={self.id!r}, title={self.title!r}, user_id={self.user_id!r})"
@@ -37,14 +88,16 @@ class Thread(Base):
 
 class Message(Base):
     __tablename__ = "message"
+    # History and listing queries filter on thread_id and walk messages in id order
+    __table_args__ = (Index("ix_message_thread_id_id", "thread_id", "id"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
     content: Mapped[str] = mapped_column(Text)
-    role: Mapped[str] = mapped_column(String(20))  # 'user' or 'assistant'
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    thread_id: Mapped[int] = mapped_column(ForeignKey("thread.id"))
+    role: Mapped[Role] = mapped_column(RoleType)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=utcnow())
+    thread_id: Mapped[int] = mapped_column(ForeignKey("thread.id", ondelete="CASCADE"))
     
-    thread: Mapped["Thread"] = relationship(back_populates="messages")
+    thread: Mapped["Thread"] = relationship(back_populates="messages", lazy="raise_on_sql")
 
     def __repr__(self) -> str:
         return f"Message(id={self.id!r}, role={self.role!r}, thread_id={self.thread_id!r})"
@@ -0,0 +1,46 @@
+from datetime import datetime
+from typing import Any
+import msgspec
+from sqlalchemy.engine import Row
+from starlette.responses import Response
+
+from app.models import Message
+
+
+# msgspec Structs mirroring the Message and ThreadListItem schemas, used on the list endpoints
+class MessageOut(msgspec.Struct):
+    content: str
+    role: str
+    id: int
+    created_at: datetime
+    thread_id: int
+
+
+class ThreadListItemOut(msgspec.Struct):
+    title: str
+    id: int
+    user_id: int
+
+
+_encoder = msgspec.json.Encoder()
+
+
+class MsgSpecResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return _encoder.encode(content)
+
+
+def message_out(message: Message) -> MessageOut:
+    return MessageOut(
+        content=message.content,
+        role=message.role,
+        id=message.id,
+        created_at=message.created_at,
+        thread_id=message.thread_id,
+    )
+
+
+def thread_list_item_out(row: Row) -> ThreadListItemOut:
+    return ThreadListItemOut(title=row.title, id=row.id, user_id=row.user_id)
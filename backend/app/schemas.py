@@ -1,24 +1,30 @@
 from datetime import datetime
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import Any, List, Optional
+from pydantic import BaseModel, ConfigDict
+
+from app.models import Role
 
 
 class MessageBase(BaseModel):
     content: str
-    role: str
+    role: Role
 
 
 class MessageCreate(MessageBase):
     pass
 
 
+class MessageFrame(BaseModel):
+    """A chat message received over the websocket; the server assigns the role."""
+    content: str
+
+
 class Message(MessageBase):
     id: int
     created_at: datetime
     thread_id: int
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ThreadBase(BaseModel):
@@ -29,6 +35,14 @@ class ThreadCreate(ThreadBase):
     user_id: int
 
 
+class ThreadListItem(ThreadBase):
+    """A thread as it appears in a user's thread list, without timestamps or messages."""
+    id: int
+    user_id: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class Thread(ThreadBase):
     id: int
     created_at: datetime
@@ -36,8 +50,7 @@ class Thread(ThreadBase):
     user_id: int
     messages: List[Message] = []
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class UserBase(BaseModel):
@@ -45,9 +58,25 @@ class UserBase(BaseModel):
 
 
 
+class UserSummary(UserBase):
+    id: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class User(UserBase):
     id: int
     threads: List[Thread] = []
 
-    class Config:
-        from_attributes = True 
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BatchRequestItem(BaseModel):
+    method: str
+    url: str
+    body: Optional[Any] = None
+
+
+class BatchResponseItem(BaseModel):
+    status_code: int
+    body: Optional[Any] = None
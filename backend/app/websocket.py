@@ -1,132 +1,165 @@
-from typing import Dict, List
+from datetime import datetime, timezone
+from typing import Callable, Dict, Set
 from fastapi import WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
-import json
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import ValidationError
+import asyncio
 import logging
-from datetime import datetime
+import msgspec
 
-from app.db import SessionLocal
 from app.models import Thread, Message
-from app.schemas import MessageCreate
-from app.crud import get_thread, create_message, get_thread_messages
-from app.chatbot import SimpleChatbot
+from app.schemas import MessageCreate, MessageFrame
+from app.crud import thread_exists, create_messages
+from app.chatbot import get_chatbot
+from app.history import history_cache
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Inbound chat frames larger than this are dropped without being parsed
+MAX_FRAME_CHARS = 64 * 1024
+
+_encoder = msgspec.json.Encoder()
+
 class ConnectionManager:
     def __init__(self):
         # Store active connections per thread
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+        self.active_connections: Dict[int, Set[WebSocket]] = {}
 
     async def connect(self, websocket: WebSocket, thread_id: int):
         await websocket.accept()
-        if thread_id not in self.active_connections:
-            self.active_connections[thread_id] = []
-        self.active_connections[thread_id].append(websocket)
-        logger.info(f"New WebSocket connection established for thread {thread_id}. Total connections: {len(self.active_connections[thread_id])}")
+        self.active_connections.setdefault(thread_id, set()).add(websocket)
+        logger.info("New WebSocket connection established for thread %s. Total connections: %d", thread_id, len(self.active_connections[thread_id]))
 
     def disconnect(self, websocket: WebSocket, thread_id: int):
-        if thread_id in self.active_connections:
-            self.active_connections[thread_id].remove(websocket)
-            if not self.active_connections[thread_id]:
+        # Safe to call more than once; only the call that removes the socket logs
+        connections = self.active_connections.get(thread_id)
+        if connections is not None and websocket in connections:
+            connections.remove(websocket)
+            if not connections:
                 del self.active_connections[thread_id]
-            logger.info(f"WebSocket connection closed for thread {thread_id}. Remaining connections: {len(self.active_connections.get(thread_id, []))}")
+            logger.info("WebSocket connection closed for thread %s. Remaining connections: %d", thread_id, len(self.active_connections.get(thread_id, [])))
 
     async def broadcast_to_thread(self, message: dict, thread_id: int):
         if thread_id in self.active_connections:
-            logger.info(f"Broadcasting message to {len(self.active_connections[thread_id])} clients in thread {thread_id}")
-            for connection in self.active_connections[thread_id]:
-                try:
-                    await connection.send_json(message)
-                    logger.info(f"Message broadcast successful to client in thread {thread_id}")
-                except Exception as e:
-                    logger.error(f"Failed to broadcast message to client in thread {thread_id}: {str(e)}")
-
-def format_datetime(dt: datetime) -> str:
-    """Format datetime to ISO format with timezone information."""
-    return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            logger.debug("Broadcasting message to %d clients in thread %s", len(self.active_connections[thread_id]), thread_id)
+            # Serialize once for every client instead of once per send_json call
+            payload = _encoder.encode(message).decode()
+            # Send to all clients concurrently so one slow socket doesn't hold up the rest
+            connections = tuple(self.active_connections[thread_id])
+            results = await asyncio.gather(
+                *(connection.send_text(payload) for connection in connections),
+                return_exceptions=True
+            )
+            for connection, result in zip(connections, results):
+                if isinstance(result, Exception):
+                    logger.error("Failed to broadcast message to client in thread %s: %s", thread_id, result)
+                    # Stop sending to a dead socket; its own handler cleans up the rest
+                    self.disconnect(connection, thread_id)
+                else:
+                    logger.debug("Message broadcast successful to client in thread %s", thread_id)
+
+class BroadcastMessage(msgspec.Struct):
+    """A stored message as sent to websocket clients; msgspec builds its encoder once."""
+    id: int
+    content: str
+    role: str
+    created_at: datetime
+    thread_id: int
+
+
+def to_broadcast_message(message: Message) -> BroadcastMessage:
+    """Build the websocket payload for a stored message straight from the ORM row."""
+    return BroadcastMessage(
+        id=message.id,
+        content=message.content,
+        role=message.role,
+        # Stored timestamps are naive UTC; marking them encodes a trailing "Z" for the frontend
+        created_at=message.created_at.replace(tzinfo=timezone.utc),
+        thread_id=message.thread_id
+    )
 
 manager = ConnectionManager()
-chatbot = SimpleChatbot()
 
-async def handle_websocket(websocket: WebSocket, thread_id: int):
-    db = SessionLocal()
+async def handle_websocket(
+    websocket: WebSocket, thread_id: int, session_factory: Callable[[], AsyncSession]
+):
+    chatbot = get_chatbot()
     try:
         await manager.connect(websocket, thread_id)
-        
-        # Verify thread exists
-        db_thread = get_thread(db, thread_id)
-        if not db_thread:
-            logger.error(f"Thread {thread_id} not found")
-            await websocket.close(code=4004, reason="Thread not found")
-            return
-
-        logger.info(f"Starting message loop for thread {thread_id}")
+
+        # Sessions are opened per unit of work so an idle socket doesn't pin a pooled connection
+        async with session_factory() as db:
+            # Verify thread exists
+            if not await thread_exists(db, thread_id):
+                logger.error("Thread %s not found", thread_id)
+                await websocket.close(code=4004, reason="Thread not found")
+                return
+
+            # Load the conversation once; each turn below appends to the cached copy
+            await history_cache.get(db, thread_id)
+
+        logger.info("Starting message loop for thread %s", thread_id)
         while True:
             # Receive message from client
             data = await websocket.receive_text()
-            logger.info(f"Received message from client in thread {thread_id}: {data}")
-            message_data = json.loads(data)
-            
-            # Create user message
-            user_message = MessageCreate(
-                content=message_data["content"],
+            logger.debug("Received message from client in thread %s: %s", thread_id, data)
+            # Cheap checks first so obvious garbage never reaches the validator
+            if not data or len(data) > MAX_FRAME_CHARS or data[0] != "{":
+                logger.warning("Dropping malformed frame in thread %s", thread_id)
+                continue
+            # Parse and validate the frame in one pass, without an intermediate dict
+            try:
+                frame = MessageFrame.model_validate_json(data)
+            except ValidationError:
+                logger.warning("Dropping invalid message frame in thread %s", thread_id)
+                continue
+
+            # Build user message
+            user_message = MessageCreate.model_construct(
+                content=frame.content,
                 role="user"
             )
-            db_message = create_message(db, user_message, thread_id)
-            logger.info(f"Created user message in thread {thread_id}")
-            
-            # Broadcast user message to all clients in the thread
-            await manager.broadcast_to_thread(
-                {
-                    "type": "message",
-                    "data": {
-                        "id": db_message.id,
-                        "content": db_message.content,
-                        "role": db_message.role,
-                        "created_at": format_datetime(db_message.created_at),
-                        "thread_id": db_message.thread_id
-                    }
-                },
-                thread_id
-            )
-            
-            # Get conversation history
-            conversation_history = get_thread_messages(db, thread_id)
-            history_dict = [{"role": msg.role, "content": msg.content} for msg in conversation_history]
-            
-            # Generate and create bot response
-            bot_response = chatbot.generate_response(message_data["content"], history_dict)
-            bot_message = MessageCreate(
-                content=bot_response,
-                role="assistant"
-            )
-            db_bot_message = create_message(db, bot_message, thread_id)
-            logger.info(f"Created bot response in thread {thread_id}")
-            
-            # Broadcast bot response to all clients in the thread
+
+            async with session_factory() as db:
+                # Get conversation history, only hitting the database if the cache entry expired
+                history_dict = await history_cache.get(db, thread_id)
+                history_cache.append(thread_id, user_message.role, user_message.content)
+
+                # Generate bot response
+                bot_response = chatbot.generate_response(frame.content, history_dict)
+                # Server-generated, so skip validation
+                bot_message = MessageCreate.model_construct(
+                    content=bot_response,
+                    role="assistant"
+                )
+
+                # Store both messages of the turn with one INSERT and one commit
+                db_message, db_bot_message = await create_messages(
+                    db, [user_message, bot_message], thread_id
+                )
+            history_cache.append(thread_id, db_bot_message.role, db_bot_message.content)
+            logger.debug("Created user message and bot response in thread %s", thread_id)
+
+            # Broadcast the whole turn to all clients in the thread as one frame
             await manager.broadcast_to_thread(
                 {
-                    "type": "message",
+                    "type": "messages",
                     "data": {
-                        "id": db_bot_message.id,
-                        "content": db_bot_message.content,
-                        "role": db_bot_message.role,
-                        "created_at": format_datetime(db_bot_message.created_at),
-                        "thread_id": db_bot_message.thread_id
+                        "items": [
+                            to_broadcast_message(db_message),
+                            to_broadcast_message(db_bot_message)
+                        ]
                     }
                 },
                 thread_id
             )
 
     except WebSocketDisconnect:
-        logger.info(f"WebSocket disconnected for thread {thread_id}")
-        manager.disconnect(websocket, thread_id)
+        logger.info("WebSocket disconnected for thread %s", thread_id)
     except Exception as e:
-        logger.error(f"WebSocket error in thread {thread_id}: {str(e)}")
-        manager.disconnect(websocket, thread_id)
+        logger.error("WebSocket error in thread %s: %s", thread_id, e)
+        # The cached history may hold a message from the turn that was rolled back
+        history_cache.invalidate(thread_id)
         await websocket.close(code=1011, reason=str(e))
     finally:
-        db.close() 
\ No newline at end of file
+        manager.disconnect(websocket, thread_id)
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+# Same effect as PYTHONDONTWRITEBYTECODE=1 for everything imported after this point
+sys.dont_write_bytecode = True
+
+from main import app  # noqa: E402
+from app.batcher import MessageBatcher, get_message_batcher  # noqa: E402
+from app.crud import clear_caches  # noqa: E402
+from app.db import get_async_db, get_session_factory  # noqa: E402
+from app.history import history_cache  # noqa: E402
+from app.models import Base  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def database_url():
+    """In-memory SQLite URL private to the current pytest-xdist worker."""
+    worker_id = os.environ.get("PYTEST_XDIST_WORKER", "gw0")
+    return f"sqlite+aiosqlite:///file:memdb_{worker_id}?mode=memory&cache=shared&uri=true"
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    """One event loop for the whole run so session-scoped async fixtures can share it."""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def _session(connection):
+    # Commits only release a SAVEPOINT; the outer transaction is never committed
+    return AsyncSession(
+        bind=connection,
+        join_transaction_mode="create_savepoint",
+        expire_on_commit=False,
+    )
+
+
+class ASGIWebSocket:
+    """
+    Minimal in-loop websocket client: drives the ASGI app through queues on the test's own event loop,
+    so the handler shares the loop (and the db_session connection) with the test.
+    """
+
+    def __init__(self, app, path: str, timeout: float = 5):
+        self.timeout = timeout
+        self._app = app
+        self._scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "server": ("test", 80),
+            "client": ("testclient", 50000),
+            "root_path": "",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "headers": [(b"host", b"test")],
+            "subprotocols": [],
+        }
+        self._inbound: asyncio.Queue = asyncio.Queue()
+        self._outbound: asyncio.Queue = asyncio.Queue()
+        self._task = None
+
+    async def __aenter__(self):
+        self._task = asyncio.ensure_future(self._app(self._scope, self._inbound.get, self._outbound.put))
+        await self._inbound.put({"type": "websocket.connect"})
+        message = await self._next()
+        assert message["type"] == "websocket.accept", message
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._inbound.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self._task, self.timeout)
+
+    async def _next(self) -> dict:
+        return await asyncio.wait_for(self._outbound.get(), self.timeout)
+
+    async def send_text(self, text: str):
+        await self._inbound.put({"type": "websocket.receive", "text": text})
+
+    async def receive_json(self):
+        message = await self._next()
+        assert message["type"] == "websocket.send", message
+        return json.loads(message["text"])
+
+
+@pytest.fixture(scope="function")
+def websocket_connect():
+    """Open an in-loop websocket to the app: `async with websocket_connect(path) as websocket: ...`."""
+    return lambda path: ASGIWebSocket(app, path)
+
+
+@pytest.fixture(scope="session")
+async def client():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as c:
+        yield c
+
+
+@pytest.fixture(scope="session")
+async def engine(database_url):
+    engine = create_async_engine(
+        database_url,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+        # Same compiled-statement cache size as the application engine
+        query_cache_size=1200,
+    )
+
+    # Let SQLAlchemy emit BEGIN itself so SAVEPOINTs work on SQLite,
+    # enforce foreign keys the way Postgres does, and skip durability work
+    # that a throwaway test database doesn't need
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.execute("PRAGMA journal_mode=MEMORY")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _on_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture(scope="function")
+async def db_session(engine):
+    # Everything a test writes happens inside this transaction and is rolled back afterwards
+    connection = await engine.connect()
+    transaction = await connection.begin()
+
+    async def override_get_async_db():
+        async with _session(connection) as session:
+            yield session
+
+    batcher = MessageBatcher(lambda: _session(connection))
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_message_batcher] = lambda: batcher
+    app.dependency_overrides[get_session_factory] = lambda: lambda: _session(connection)
+    session = _session(connection)
+    try:
+        yield session
+    finally:
+        app.dependency_overrides.pop(get_async_db, None)
+        app.dependency_overrides.pop(get_message_batcher, None)
+        app.dependency_overrides.pop(get_session_factory, None)
+        await session.close()
+        await transaction.rollback()
+        await connection.close()
+        # Rolled-back ids are handed out again, so nothing cached from this test may survive it
+        clear_caches()
+        history_cache.clear()
@@ -1,12 +1,35 @@
-from fastapi import FastAPI, WebSocket
+from contextlib import asynccontextmanager
+import logging
+from typing import Callable
+from fastapi import Depends, FastAPI, Request, WebSocket
+from sqlalchemy.ext.asyncio import AsyncSession
 from seed import seed_user_if_needed
 from app.api import router as api_router
+from app.db import get_engine, get_session_factory, init_db
 from app.websocket import handle_websocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from app.logging_config import setup_logging
 
-seed_user_if_needed()
+setup_logging()
+logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Chatbot API", description="Backend API for chatbot application")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    await seed_user_if_needed()
+    yield
+    # Close the pooled connections instead of leaving them for the server to time out
+    await get_engine().dispose()
+
+
+app = FastAPI(
+    title="Chatbot API",
+    description="Backend API for chatbot application",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 # Add CORS middleware configuration
 app.add_middleware(
@@ -17,13 +40,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Anything not raised as an HTTPException ends up here as a generic 500
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    logger.exception("Unhandled error on %s %s", request.method, request.url.path)
+    return ORJSONResponse({"detail": "Internal Server Error"}, status_code=500)
+
 # Include the API router
 app.include_router(api_router, prefix="/api/v1", tags=["chatbot"])
 
 # WebSocket endpoint
 @app.websocket("/ws/threads/{thread_id}")
-async def websocket_endpoint(websocket: WebSocket, thread_id: int):
-    await handle_websocket(websocket, thread_id)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    thread_id: int,
+    session_factory: Callable[[], AsyncSession] = Depends(get_session_factory),
+):
+    await handle_websocket(websocket, thread_id, session_factory)
 
 @app.get("/")
 async def root():
@@ -0,0 +1,37 @@
+-- Upgrades a database created before message roles became SMALLINT codes.
+-- create_all only creates missing tables, so these changes have to be applied by hand:
+--   psql -h localhost -U postgres -d postgres -f migrations/001_role_codes_defaults_cascades.sql
+-- Safe to run more than once.
+BEGIN;
+
+-- 'user' -> 1, 'assistant' -> 2 (see app.models.RoleType); works from VARCHAR or the message_role enum
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'message' AND column_name = 'role') <> 'smallint' THEN
+        ALTER TABLE message ALTER COLUMN role TYPE SMALLINT
+            USING CASE role::text WHEN 'user' THEN 1 WHEN 'assistant' THEN 2 END;
+    END IF;
+END $$;
+DROP TYPE IF EXISTS message_role;
+
+-- Timestamps are stamped by the database, in UTC (see app.models.utcnow)
+ALTER TABLE thread
+    ALTER COLUMN created_at SET DEFAULT timezone('utc', now()),
+    ALTER COLUMN updated_at SET DEFAULT timezone('utc', now());
+ALTER TABLE message ALTER COLUMN created_at SET DEFAULT timezone('utc', now());
+
+-- Deleting a user or thread removes its children in the database
+ALTER TABLE thread
+    DROP CONSTRAINT IF EXISTS thread_user_id_fkey,
+    ADD CONSTRAINT thread_user_id_fkey
+        FOREIGN KEY (user_id) REFERENCES "user" (id) ON DELETE CASCADE;
+ALTER TABLE message
+    DROP CONSTRAINT IF EXISTS message_thread_id_fkey,
+    ADD CONSTRAINT message_thread_id_fkey
+        FOREIGN KEY (thread_id) REFERENCES thread (id) ON DELETE CASCADE;
+
+CREATE INDEX IF NOT EXISTS ix_thread_user_id ON thread (user_id);
+CREATE INDEX IF NOT EXISTS ix_message_thread_id_id ON message (thread_id, id);
+
+COMMIT;
@@ -1,15 +1,13 @@
 from sqlalchemy import select
-from sqlalchemy.orm import Session
-from app.db import sync_engine
+from app.db import AsyncSessionLocal
 from app.models import User
 
 
-def seed_user_if_needed():
-    with Session(sync_engine) as session:
-        with session.begin():
-            if session.execute(select(User)).scalar_one_or_none() is not None:
+async def seed_user_if_needed():
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            if (await session.execute(select(User))).scalar_one_or_none() is not None:
                 print("User already exists, skipping seeding")
                 return
             print("Seeding user")
             session.add(User(name="Alice"))
-            session.commit()
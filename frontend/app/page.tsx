@@ -3,12 +3,12 @@
 import { useState, useEffect } from 'react';
 import { ChatAPI } from './services/api';
 import { Chat } from './components/Chat';
-import { Thread, User } from './types/chat';
+import { ThreadSummary, User } from './types/chat';
 
 export default function Home() {
   const [user, setUser] = useState<User | null>(null);
-  const [threads, setThreads] = useState<Thread[]>([]);
-  const [selectedThread, setSelectedThread] = useState<Thread | null>(null);
+  const [threads, setThreads] = useState<ThreadSummary[]>([]);
+  const [selectedThread, setSelectedThread] = useState<ThreadSummary | null>(null);
   const [error, setError] = useState<string | null>(null);
   const [isNewChatDialogOpen, setIsNewChatDialogOpen] = useState(false);
   const [newChatTitle, setNewChatTitle] = useState('');
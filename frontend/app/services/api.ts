@@ -1,4 +1,4 @@
-import { Thread, Message, User, CreateThreadRequest, CreateMessageRequest } from '../types/chat';
+import { Thread, ThreadSummary, Message, User, CreateThreadRequest, CreateMessageRequest } from '../types/chat';
 
 const API_BASE_URL = 'http://127.0.0.1:8000/api/v1';
 
@@ -45,7 +45,7 @@ export class ChatAPI {
     return response.json();
   }
 
-  static async getUserThreads(userId: number): Promise<Thread[]> {
+  static async getUserThreads(userId: number): Promise<ThreadSummary[]> {
     const response = await fetch(`${API_BASE_URL}/users/${userId}/threads/`);
 
     if (!response.ok) {
@@ -87,18 +87,25 @@ export class WebSocketService {
         try {
           console.log('Received WebSocket message:', event.data);
           const rawMessage = JSON.parse(event.data);
-          const message = this.parseMessage(rawMessage);
-          
-          if (message.thread_id !== this.currentThreadId) {
-            console.warn(`Received message for wrong thread. Expected ${this.currentThreadId}, got ${message.thread_id}`);
-            return;
-          }
-          
-          if (this.messageHandler) {
-            console.log('Dispatching message to handler');
-            this.messageHandler(message);
-          } else {
-            console.warn('No message handler registered');
+          // A turn (user message + bot response) arrives as one "messages" frame
+          const rawMessages = rawMessage.type === 'messages' && rawMessage.data
+            ? rawMessage.data.items
+            : [rawMessage];
+
+          for (const raw of rawMessages) {
+            const message = this.parseMessage(raw);
+
+            if (message.thread_id !== this.currentThreadId) {
+              console.warn(`Received message for wrong thread. Expected ${this.currentThreadId}, got ${message.thread_id}`);
+              continue;
+            }
+
+            if (this.messageHandler) {
+              console.log('Dispatching message to handler');
+              this.messageHandler(message);
+            } else {
+              console.warn('No message handler registered');
+            }
           }
         } catch (error) {
           console.error('Error handling WebSocket message:', error);
@@ -4,6 +4,12 @@ export interface User {
   threads?: Thread[];
 }
 
+export interface ThreadSummary {
+  id: number;
+  title: string;
+  user_id: number;
+}
+
 export interface Thread {
   id: number;
   title: string;